@@ -1,5 +1,6 @@
 import logging
-from typing import Optional
+import re
+from typing import Any, Dict, List, Optional
 
 from langchain_openai import ChatOpenAI
 from pydantic import BaseModel, Field
@@ -10,68 +11,110 @@ from ...config.settings import get_settings
 
 logger = logging.getLogger(__name__)
 
+# 降级分类的分句规则：只有落在不同分句中的请求才拆分为多个子意图
+_CLAUSE_SEPARATORS = re.compile(r"[，,；;。]|然后|顺便")
+
+
+def _prompt_cache_kwargs() -> Dict[str, Any]:
+    """开启服务端前缀缓存：配置了 prompt_cache_key 时随请求透传给 OpenAI 兼容接口"""
+    cache_key = get_settings().llm.prompt_cache_key
+    return {"extra_body": {"prompt_cache_key": cache_key}} if cache_key else {}
+
+
 _LLM_INTENT = ChatOpenAI(
     model=get_settings().llm.model.intent,
     api_key=get_settings().llm.get_key,
-    base_url=get_settings().llm.host
+    base_url=get_settings().llm.host,
+    **_prompt_cache_kwargs()
 )
 
 # 定义意图分类的结构化输出模型
-class IntentClassification(BaseModel):
-    """意图分类结果"""
+class EntityExtraction(BaseModel):
+    """实体提取结果"""
+    city_name: Optional[str] = Field(default=None, description="城市名称")
+    device_name: Optional[str] = Field(default=None, description="设备名称")
+    action: Optional[str] = Field(default=None, description="执行动作")
+    time_expression: Optional[str] = Field(default=None, description="时间表达式")
+    location: Optional[str] = Field(default=None, description="具体位置")
+
+
+class SubIntent(BaseModel):
+    """单个子意图及其实体"""
     intent: str = Field(description="识别出的意图类型")
-    confidence: float = Field(description="分类置信度", ge=0, le=1)
-    requires_clarification: bool = Field(description="是否需要进一步澄清")
-    clarification_question: Optional[str] = Field(description="需要澄清的问题")
+    confidence: float = Field(default=1.0, description="分类置信度", ge=0, le=1)
+    requires_clarification: bool = Field(default=False, description="是否需要进一步澄清")
+    clarification_question: Optional[str] = Field(default=None, description="需要澄清的问题")
+    entities: EntityExtraction = Field(default_factory=EntityExtraction, description="该子意图相关的实体")
 
 
-class EntityExtraction(BaseModel):
-    """实体提取结果"""
-    city_name: Optional[str] = Field(description="城市名称")
-    device_name: Optional[str] = Field(description="设备名称")
-    action: Optional[str] = Field(description="执行动作")
-    time_expression: Optional[str] = Field(description="时间表达式")
-    location: Optional[str] = Field(description="具体位置")
+class IntentDecomposition(BaseModel):
+    """多意图拆分结果"""
+    sub_intents: List[SubIntent] = Field(description="按用户表述顺序拆分出的子意图列表")
 
 
-def create_intent_recognition_system():
-    """创建意图识别系统"""
+# 结构化输出链只构建一次：模板 -> 模型（schema 固定），include_raw 用于读取 token 用量
+_INTENT_DECOMPOSER = jarvis_prompt.INTENT_RECOGNITION_PROMPT | _LLM_INTENT.with_structured_output(
+    IntentDecomposition, include_raw=True
+)
 
-    def recognize_intent(state: JarvisState) -> JarvisState:
-        """核心意图识别节点"""
 
-        system_prompt = jarvis_prompt.get_intent_recognition_system()
+def _extract_token_usage(raw: Any) -> Dict[str, int]:
+    """
+    从原始 AIMessage 中提取 prompt token 与缓存命中 token 数
+    兼容 LangChain usage_metadata、OpenAI prompt_tokens_details 以及 DeepSeek prompt_cache_hit_tokens
+    """
+    usage = getattr(raw, "usage_metadata", None) or {}
+    prompt_tokens = usage.get("input_tokens", 0)
+    cached_tokens = (usage.get("input_token_details") or {}).get("cache_read", 0)
+
+    token_usage = (getattr(raw, "response_metadata", None) or {}).get("token_usage") or {}
+    if not prompt_tokens:
+        prompt_tokens = token_usage.get("prompt_tokens", 0)
+    if not cached_tokens:
+        cached_tokens = ((token_usage.get("prompt_tokens_details") or {}).get("cached_tokens")
+                         or token_usage.get("prompt_cache_hit_tokens", 0))
+
+    return {"prompt_tokens": prompt_tokens or 0, "cached_tokens": cached_tokens or 0}
+
+
+def _invoke_structured(chain, user_input: str, stage: str):
+    """调用结构化输出链，记录 token 用量，返回 (解析结果, token 用量)"""
+    result = chain.invoke({"user_input": user_input})
+    if result.get("parsing_error") or result.get("parsed") is None:
+        raise ValueError(f"{stage} structured output parsing failed: {result.get('parsing_error')}")
+
+    usage = _extract_token_usage(result.get("raw"))
+    logger.info(f"📊 {stage} prompt_tokens={usage['prompt_tokens']} cached_tokens={usage['cached_tokens']}")
+    return result["parsed"], usage
 
-        user_prompt = f"用户输入: {state['user_input']}"
 
-        # 使用结构化输出确保结果一致性
-        intent_classifier = _LLM_INTENT.with_structured_output(IntentClassification)
-        entity_extractor = _LLM_INTENT.with_structured_output(EntityExtraction)
+def create_intent_recognition_system(decomposer=_INTENT_DECOMPOSER):
+    """
+    创建意图识别系统
+    :param decomposer: 意图拆分链，需返回 {"raw", "parsed", "parsing_error"}（流量回放时可替换为假 LLM 后端）
+    """
+
+    def recognize_intent(state: JarvisState) -> JarvisState:
+        """核心意图识别节点"""
 
         try:
-            # 识别意图
-            intent_result = intent_classifier.invoke([
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ])
-
-            # 提取实体
-            entity_result = entity_extractor.invoke(user_prompt)
-            logger.info(msg="Success to intent classifier")
+            # 一次调用完成多意图拆分与实体提取
+            decomposition, usage = _invoke_structured(decomposer, state["user_input"], "intent")
+            if not decomposition.sub_intents:
+                raise ValueError("intent decomposition returned no sub intents")
+
+            sub_intents = [sub.model_dump() for sub in decomposition.sub_intents]
+            primary = sub_intents[0]
+            logger.info(msg=f"Success to intent classifier: {[sub['intent'] for sub in sub_intents]}")
             return {
-                "user_input": user_prompt,
-                "primary_intent": intent_result.intent,
-                "extracted_entities": {
-                    "city_name": entity_result.city_name,
-                    "device_name": entity_result.device_name,
-                    "action": entity_result.action,
-                    "time_expression": entity_result.time_expression,
-                    "location": entity_result.location
-                },
+                "primary_intent": primary["intent"],
+                "extracted_entities": primary["entities"],
+                "sub_intents": sub_intents,
                 "module_data": {
-                    "intent_confidence": intent_result.confidence,
-                    "requires_clarification": intent_result.requires_clarification,
-                    "clarification_question": intent_result.clarification_question
+                    "intent_confidence": primary["confidence"],
+                    "requires_clarification": primary["requires_clarification"],
+                    "clarification_question": primary["clarification_question"],
+                    "token_usage": {"intent": usage}
                 }
             }
 
@@ -88,22 +131,42 @@ def create_intent_recognition_system():
         # 关键词映射
         intent_keywords = {
             "weather_query": ["天气", "气温", "温度", "下雨", "下雪", "weather"],
-            "smart_home": ["打开", "关闭", "调", "开灯", "关灯", "启动", "停止"],
+            "smart_home": ["打开", "关闭", "调", "开灯", "关灯", "启动", "停止", "空调"],
             "schedule_management": ["提醒", "定时", "日程", "闹钟"],
             "general_chat": ["你好", "嗨", "你是谁", "帮助"],
         }
 
-        for intent, keywords in intent_keywords.items():
-            if any(keyword in user_input for keyword in keywords):
-                return {
-                    "primary_intent": intent,
-                    "extracted_entities": {},
-                    "module_data": {"intent_confidence": 0.7, "requires_clarification": False}
-                }
+        # 按分句分类：每个分句只取最先出现关键词的类别，避免同一句话里的关键词重叠
+        # （如"把空调温度调到26度"同时命中"温度"和"调"）被拆成多个子意图
+        matched = []
+        for clause in _CLAUSE_SEPARATORS.split(user_input):
+            hits = [
+                (clause.find(keyword), intent)
+                for intent, keywords in intent_keywords.items()
+                for keyword in keywords
+                if keyword in clause
+            ]
+            if hits:
+                matched.append(min(hits)[1])
+
+        if matched:
+            sub_intents = [
+                {"intent": intent, "confidence": 0.7, "requires_clarification": False,
+                 "clarification_question": None, "entities": {}}
+                for intent in matched
+            ]
+            return {
+                "primary_intent": sub_intents[0]["intent"],
+                "extracted_entities": {},
+                "sub_intents": sub_intents,
+                "module_data": {"intent_confidence": 0.7, "requires_clarification": False}
+            }
 
         return {
             "primary_intent": "general_chat",
             "extracted_entities": {},
+            "sub_intents": [{"intent": "general_chat", "confidence": 0.5, "requires_clarification": True,
+                             "clarification_question": None, "entities": {}}],
             "module_data": {"intent_confidence": 0.5, "requires_clarification": True}
         }
 
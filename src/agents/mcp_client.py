@@ -1,42 +1,75 @@
 import asyncio
 import logging
-from contextlib import AsyncExitStack
-from typing import Any, List
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
 
 from langchain_core.tools import StructuredTool
 from mcp.client.session import ClientSession
 from mcp.client.sse import sse_client
 from pydantic import create_model
 
-from src.config.settings import get_settings
+from src.config.settings import Settings, get_settings
 
 logger = logging.getLogger(__name__)
 
+# 优雅关闭连接的等待时间（秒），超时后强制取消连接持有任务
+_CLOSE_TIMEOUT = 5.0
+
 class McpClientManager:
     """
     企业级 MCP 连接管理器 (Singleton)
-    负责维护 SSE 长连接，防止每次请求都重新握手
+    负责维护 SSE 长连接，防止每次请求都重新握手。
+    连接由一个长期运行的后台任务从打开到关闭全程持有：sse_client / ClientSession 内部的
+    anyio task group 必须在同一个任务中进入和退出，其他任务只通过 session 收发请求。
     """
     def __init__(self, sse_url: str):
         self.sse_url = sse_url
         self.session: ClientSession | None = None
-        self._exit_stack = AsyncExitStack()
+        self._task: Optional[asyncio.Task] = None
+        self._stop: Optional[asyncio.Event] = None
+        self._lock = asyncio.Lock()
 
-    async def connect(self):
-        logger.info(f"🔌 Connecting to MCP Server: {self.sse_url}...")
+    async def _run(self, ready: asyncio.Future, stop: asyncio.Event):
+        """连接持有任务：建立连接后等待关闭信号，退出时在本任务内释放连接"""
         try:
-            sse_transport = await self._exit_stack.enter_async_context(
-                sse_client(self.sse_url)
-            )
-            self.read, self.write = sse_transport
-            self.session = await self._exit_stack.enter_async_context(
-                ClientSession(self.read, self.write)
-            )
-            await self.session.initialize()
-            logger.info("✅ MCP Connected.")
-        except Exception as e:
-            logger.error(f"❌ Connection failed: {e}")
-            raise
+            async with sse_client(self.sse_url) as (read, write):
+                async with ClientSession(read, write) as session:
+                    await session.initialize()
+                    self.session = session
+                    if not ready.done():
+                        ready.set_result(None)
+                    await stop.wait()
+        except BaseException as e:
+            if not ready.done():
+                ready.set_exception(e)
+            elif not isinstance(e, asyncio.CancelledError):
+                logger.error(f"❌ MCP connection lost ({self.sse_url}): {e}")
+            if isinstance(e, asyncio.CancelledError):
+                raise
+        finally:
+            self.session = None
+
+    async def connect(self):
+        async with self._lock:
+            if self.session:
+                return
+
+            # 清理上一次失败 / 断开的连接任务
+            await self._shutdown()
+
+            logger.info(f"🔌 Connecting to MCP Server: {self.sse_url}...")
+            ready = asyncio.get_running_loop().create_future()
+            self._stop = asyncio.Event()
+            self._task = asyncio.create_task(self._run(ready, self._stop))
+            try:
+                await ready
+                logger.info("✅ MCP Connected.")
+            except BaseException as e:
+                # 包括外层 wait_for 超时导致的取消：停止持有任务，保证下次重连从干净状态开始
+                if not isinstance(e, asyncio.CancelledError):
+                    logger.error(f"❌ Connection failed: {e}")
+                await self._shutdown()
+                raise
 
     async def ensure_connected(self):
         """Helper: 如果没连接，就自动连上"""
@@ -44,30 +77,33 @@ class McpClientManager:
             logger.warning("⚠️ Session not found, initializing auto-connect...")
             await self.connect()
 
-    async def close(self):
-        await self._exit_stack.aclose()
-
-# 全局单例 (实际项目中建议使用依赖注入)
-life_mcp_manager = McpClientManager(sse_url=get_settings().mcp_life.get_sse_url())
-
-async def get_mcp_tools(mcp_manager: McpClientManager) -> List[StructuredTool]:
-    """
-    【核心适配器】
-    从远程 MCP Server 获取工具列表，并转换为 LangChain 工具对象
-    """
-    # 1. 自动检查连接状态
-    await mcp_manager.ensure_connected()
+    async def _shutdown(self):
+        """通知持有任务退出并等待其结束（仍在握手中则直接取消）"""
+        task, self._task = self._task, None
+        try:
+            if task and not task.done():
+                if self.session and self._stop:
+                    self._stop.set()
+                    await asyncio.wait({task}, timeout=_CLOSE_TIMEOUT)
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+        finally:
+            self.session = None
+            self._stop = None
 
-    if not mcp_manager.session:
-        logger.error("MCP(life_mcp_service) Session not initialized")
-        raise RuntimeError("MCP Session not initialized")
+    async def close(self):
+        async with self._lock:
+            await self._shutdown()
 
-    # 1. 远程获取工具定义 (ListTools)
-    result = await mcp_manager.session.list_tools()
+def _to_langchain_tools(
+        tool_defs: List[Any],
+        call_tool: Callable[[str, Dict[str, Any]], Awaitable[Any]]
+) -> List[StructuredTool]:
+    """将 MCP 工具定义转换为 LangChain 工具对象，执行时交给 call_tool 转发"""
     lc_tools = []
 
-    for tool_def in result.tools:
-        # 2. 动态构建 Pydantic 参数模型
+    for tool_def in tool_defs:
+        # 1. 动态构建 Pydantic 参数模型
         # 简化处理：将所有参数设为 Any，生产环境应递归解析 JSON Schema
         fields = {
             k: (Any, ...)
@@ -75,17 +111,17 @@ async def get_mcp_tools(mcp_manager: McpClientManager) -> List[StructuredTool]:
         }
         args_schema = create_model(f"{tool_def.name}Schema", **fields)
 
-        # 3. 定义执行闭包 (Capture tool_name)
+        # 2. 定义执行闭包 (Capture tool_name)
         async def _executor(tool_name=tool_def.name, **kwargs):
             logger.info(f"   🌐 Calling Remote MCP: {tool_name} {kwargs}")
             try:
-                res = await mcp_manager.session.call_tool(tool_name, kwargs)
+                res = await call_tool(tool_name, kwargs)
                 # 提取文本结果
                 return "\n".join([c.text for c in res.content if c.type == 'text'])
             except Exception as e:
                 return f"MCP Tool Error: {str(e)}"
 
-        # 4. 封装为 LangChain Tool
+        # 3. 封装为 LangChain Tool
         lc_tools.append(StructuredTool.from_function(
             coroutine=_executor,
             name=tool_def.name,
@@ -93,4 +129,145 @@ async def get_mcp_tools(mcp_manager: McpClientManager) -> List[StructuredTool]:
             args_schema=args_schema
         ))
 
-    return lc_tools
\ No newline at end of file
+    return lc_tools
+
+
+async def get_mcp_tools(mcp_manager: McpClientManager) -> List[StructuredTool]:
+    """
+    【核心适配器】
+    从远程 MCP Server 获取工具列表，并转换为 LangChain 工具对象
+    """
+    # 1. 自动检查连接状态
+    await mcp_manager.ensure_connected()
+
+    if not mcp_manager.session:
+        logger.error(f"MCP({mcp_manager.sse_url}) Session not initialized")
+        raise RuntimeError("MCP Session not initialized")
+
+    # 2. 远程获取工具定义 (ListTools)
+    result = await mcp_manager.session.list_tools()
+
+    async def _call_tool(tool_name: str, kwargs: Dict[str, Any]):
+        return await mcp_manager.session.call_tool(tool_name, kwargs)
+
+    return _to_langchain_tools(result.tools, _call_tool)
+
+
+class McpServerRegistry:
+    """
+    多 MCP 服务注册中心
+    启动时并行连接所有服务并执行 list_tools，维护 工具名 -> 服务名 的路由索引；
+    单个服务超时或失败只会被隔离，不影响其他服务的工具加载，并在后台按间隔重试。
+    """
+    def __init__(self, servers: Dict[str, McpClientManager], timeouts: Dict[str, float],
+                 retry_interval: float = 30.0):
+        self.managers = servers
+        self.timeouts = timeouts
+        self.retry_interval = retry_interval
+        # 工具名 -> 服务名
+        self.routing_index: Dict[str, str] = {}
+        # 服务名 -> 该服务提供的 LangChain 工具
+        self._server_tools: Dict[str, List[StructuredTool]] = {}
+        self.failed: Dict[str, str] = {}
+        self._loaded = False
+        self._lock = asyncio.Lock()
+        self._retry_task: Optional[asyncio.Task] = None
+        self._last_retry = 0.0
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> "McpServerRegistry":
+        servers = settings.get_mcp_servers()
+        return cls(
+            servers={name: McpClientManager(sse_url=conf.get_sse_url()) for name, conf in servers.items()},
+            timeouts={name: conf.timeout for name, conf in servers.items()}
+        )
+
+    async def _discover(self, name: str) -> List[Any]:
+        """连接单个服务并获取工具定义"""
+        manager = self.managers[name]
+        await manager.ensure_connected()
+        result = await manager.session.list_tools()
+        return result.tools
+
+    async def _discover_all(self, names: List[str]):
+        """并行发现指定服务的工具，并更新路由索引"""
+        results = await asyncio.gather(
+            *(asyncio.wait_for(self._discover(name), timeout=self.timeouts.get(name)) for name in names),
+            return_exceptions=True
+        )
+
+        for name, result in zip(names, results):
+            if isinstance(result, BaseException):
+                reason = "timeout" if isinstance(result, asyncio.TimeoutError) else str(result)
+                logger.error(f"❌ MCP({name}) discovery failed: {reason}")
+                self.failed[name] = reason
+                # 关闭由连接持有任务完成，重试时一定会重新建立连接
+                await self.managers[name].close()
+                continue
+
+            self.failed.pop(name, None)
+            self._server_tools[name] = _to_langchain_tools(result, self.call_tool)
+            logger.info(f"🔧 MCP({name}) loaded {len(result)} tools")
+
+        self._rebuild_index()
+
+    def _rebuild_index(self):
+        """按配置顺序重建路由索引，工具重名时保留先注册的服务"""
+        index = {}
+        for name in self.managers:
+            for tool in self._server_tools.get(name, []):
+                if tool.name in index:
+                    logger.warning(f"⚠️ Duplicate MCP tool '{tool.name}' on {name}, keep {index[tool.name]}")
+                    continue
+                index[tool.name] = name
+        self.routing_index = index
+
+    async def load(self):
+        """启动时调用：并行连接全部服务，只执行一次"""
+        async with self._lock:
+            if self._loaded:
+                return
+            await self._discover_all(list(self.managers))
+            self._loaded = True
+            self._last_retry = time.monotonic()
+
+    def _schedule_retry(self):
+        """在后台重试失败的服务，不阻塞当前请求"""
+        if not self.failed or (self._retry_task and not self._retry_task.done()):
+            return
+        if time.monotonic() - self._last_retry < self.retry_interval:
+            return
+
+        self._last_retry = time.monotonic()
+        logger.info(f"🔁 Retrying MCP servers: {list(self.failed)}")
+        self._retry_task = asyncio.create_task(self._discover_all(list(self.failed)))
+
+    async def get_tools(self) -> List[StructuredTool]:
+        """返回已缓存的全部工具，不会在请求路径上重复执行 list_tools"""
+        await self.load()
+        self._schedule_retry()
+        return [
+            tool
+            for name in self.managers
+            for tool in self._server_tools.get(name, [])
+            if self.routing_index.get(tool.name) == name
+        ]
+
+    async def call_tool(self, tool_name: str, kwargs: Dict[str, Any]):
+        """根据路由索引直接调用所属服务"""
+        server = self.routing_index.get(tool_name)
+        if server is None:
+            raise KeyError(f"Unknown MCP tool: {tool_name}")
+
+        manager = self.managers[server]
+        await manager.ensure_connected()
+        return await manager.session.call_tool(tool_name, kwargs)
+
+    async def close(self):
+        if self._retry_task and not self._retry_task.done():
+            self._retry_task.cancel()
+        await asyncio.gather(*(m.close() for m in self.managers.values()), return_exceptions=True)
+
+
+# 全局单例 (实际项目中建议使用依赖注入)
+mcp_registry = McpServerRegistry.from_settings(get_settings())
@@ -1,34 +1,70 @@
-def get_intent_recognition_system():
-    return """
+from langchain_core.messages import SystemMessage
+from langchain_core.prompts import ChatPromptTemplate
+
+# 静态系统提示词：模块加载时构建一次，保证每次请求的前缀逐字节一致，
+# 以便命中服务端的前缀 / KV 缓存。请勿在其中插入时间、用户等动态内容。
+_INTENT_RECOGNITION_SYSTEM = """
 # Role
-你是智能家庭助手的中枢决策大脑。你的任务是分析用户的自然语言输入，识别其核心意图，并提取必要的关键信息。
+你是智能家庭助手的中枢决策大脑。你的任务是分析用户的自然语言输入，将其拆分为一个或多个子意图，并为每个子意图提取必要的关键信息。
 
 # Intents (意图定义)
-请根据以下分类标准判断用户意图：
-
-    1. **assistant** (生活助理): 
-       - 负责处理**信息查询**类请求。
-       - 包括：查天气、查日期、查常识、搜索网络。
-       - 即使请求很复杂（如"查下东莞天气适合穿什么"），只要是获取信息，都归此类。
-       
-    2. **iot** (智能管家):
+请根据以下分类标准判断每个子意图：
+
+    1. **weather_query** (天气查询):
+       - 负责处理天气、气温、降雨等**信息查询**类请求。
+       - 即使请求很复杂（如"查下东莞天气适合穿什么"），只要是获取天气信息，都归此类。
+
+    2. **device_control** (设备控制):
        - 负责处理**设备控制**和**状态修改**类请求。
-       - 包括：开灯、关空调、设闹钟、播放音乐。
-       
-    3. **general_chat** (闲聊):
+       - 包括：开灯、关空调、调温度、播放音乐。
+
+    3. **schedule_management** (日程管理):
+       - 负责处理提醒、定时、闹钟、日程类请求。
+
+    4. **general_chat** (闲聊):
        - 纯粹的打招呼、情感交流或无法归类的问题。
 
+# Decomposition (多意图拆分)
+    - 一句话中包含多个相互独立的请求时（如"关空调，顺便告诉我明天东莞天气"），按表述顺序拆分为多个子意图。
+    - 每个子意图只携带属于它自己的实体，不要把其他子意图的实体混入。
+    - 只有一个请求时，返回仅含一个元素的列表。
+
 # Examples (少样本演示)
 
 User: "帮我查一下东莞松山湖现在的天气"
-Output: {"intent": "assistant", "params": {"city": "东莞松山湖", "date": "现在"}}
+Output: {"sub_intents": [{"intent": "weather_query", "entities": {"city_name": "东莞", "location": "松山湖", "time_expression": "现在"}}]}
 
 User: "把客厅的灯打开"
-Output: {"intent": "iot", "params": {"device": "客厅灯", "action": "turn_on"}}
+Output: {"sub_intents": [{"intent": "device_control", "entities": {"device_name": "灯", "action": "打开", "location": "客厅"}}]}
+
+User: "关空调，顺便告诉我明天东莞天气"
+Output: {"sub_intents": [{"intent": "device_control", "entities": {"device_name": "空调", "action": "关闭"}}, {"intent": "weather_query", "entities": {"city_name": "东莞", "time_expression": "明天"}}]}
 
 User: "你叫什么名字？"
-Output: {"intent": "general_chat", "params": {}, "response": "我是您的家庭助手。"}
+Output: {"sub_intents": [{"intent": "general_chat", "entities": {}}]}
 
 User: "今天出门要带伞吗？"
-Output: {"intent": "assistant", "params": {"city": null, "date": "今天"}}
+Output: {"sub_intents": [{"intent": "weather_query", "entities": {"city_name": null, "time_expression": "今天"}}]}
 """
+
+_USER_INPUT_TEMPLATE = "用户输入: {user_input}"
+
+
+def get_intent_recognition_system():
+    return _INTENT_RECOGNITION_SYSTEM
+
+
+def _build_intent_prompt() -> ChatPromptTemplate:
+    """
+    构建意图拆分（含实体提取）的消息模板
+    系统提示词以 SystemMessage 实例传入，不参与变量格式化（few-shot 中的花括号无需转义），
+    只有末尾的用户消息是动态的。
+    """
+    return ChatPromptTemplate.from_messages([
+        SystemMessage(content=_INTENT_RECOGNITION_SYSTEM),
+        ("human", _USER_INPUT_TEMPLATE),
+    ])
+
+
+# 预构建模板 (模块级单例)
+INTENT_RECOGNITION_PROMPT = _build_intent_prompt()
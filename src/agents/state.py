@@ -1,4 +1,5 @@
-from typing import Dict, Optional, Any
+import operator
+from typing import Annotated, Dict, List, Optional, Any
 
 from langgraph.graph import MessagesState
 
@@ -13,10 +14,14 @@ class JarvisState(MessagesState):
     primary_intent: str
     # 从用户输入中提取的实体（如城市名、设备名、时间等）
     extracted_entities: Dict[str, Any]
+    # 拆分出的子意图列表（每项包含 intent、entities 及澄清信息），按用户表述顺序排列
+    sub_intents: List[Dict[str, Any]]
     # 对话历史
     # conversation_history: Annotated[List[Dict], operator.add]
     # 各功能模块的中间结果
     module_data: Dict[str, Any]
+    # 并行子工作流的执行结果（reducer 合并各分支的写入）
+    workflow_results: Annotated[List[Dict[str, Any]], operator.add]
     # 助手最终响应
     assistant_response: str
     # 当前活跃的子工作流（用于复杂任务）
@@ -24,4 +29,4 @@ class JarvisState(MessagesState):
     # 错误信息
     error: Optional[str]
     # 时间戳
-    timestamp: str
\ No newline at end of file
+    timestamp: str
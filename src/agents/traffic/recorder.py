@@ -0,0 +1,246 @@
+import atexit
+import inspect
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import threading
+import time
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler, BaseCallbackManager
+from langchain_core.callbacks.manager import adispatch_custom_event, dispatch_custom_event
+from langchain_core.runnables import RunnableConfig
+
+from src.config.settings import Settings
+
+logger = logging.getLogger(__name__)
+
+# 脱敏规则：按顺序替换，先匹配更具体的模式
+_ANONYMIZE_PATTERNS = [
+    (re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+"), "<email>"),
+    (re.compile(r"(?<!\d)1[3-9]\d{9}(?!\d)"), "<phone>"),
+    (re.compile(r"(?<!\d)\d{15,18}[\dXx]?(?!\d)"), "<id>"),
+    (re.compile(r"\d{6,}"), "<num>"),
+]
+
+
+def anonymize(text: str) -> str:
+    """脱敏用户输入：去除邮箱、手机号、证件号与长数字串，保留意图相关的文本"""
+    for pattern, placeholder in _ANONYMIZE_PATTERNS:
+        text = pattern.sub(placeholder, text)
+    return text
+
+
+# 节点函数体开始 / 结束执行时派发的自定义事件名（见 timed_node）
+STAGE_BODY_START_EVENT = "stage_body_start"
+STAGE_BODY_END_EVENT = "stage_body_end"
+
+
+def _stage_timer_attached(config: RunnableConfig) -> bool:
+    """当前运行是否挂载了 StageTimer（未挂载时不派发计时事件）"""
+    callbacks = config.get("callbacks")
+    handlers = callbacks.handlers if isinstance(callbacks, BaseCallbackManager) else (callbacks or [])
+    return any(isinstance(handler, StageTimer) for handler in handlers)
+
+
+def timed_node(fn):
+    """
+    包装图节点：挂载了 StageTimer 时，在函数体开始和结束时各派发一个自定义事件，供其区分排队与执行耗时。
+    未挂载时直接调用原函数，不派发事件，astream_events 等消费方也不会看到这些计时事件。
+    同步节点包装后仍是同步函数，LangGraph 照常将其放入线程池执行；
+    节点运行中函数体之外的时间（等待空闲线程、同步路由函数的线程池排队）都计为排队时间。
+    """
+    if inspect.iscoroutinefunction(fn):
+        async def node(state, config: RunnableConfig):
+            if not _stage_timer_attached(config):
+                return await fn(state)
+            await adispatch_custom_event(STAGE_BODY_START_EVENT, {}, config=config)
+            try:
+                return await fn(state)
+            finally:
+                await adispatch_custom_event(STAGE_BODY_END_EVENT, {}, config=config)
+    else:
+        def node(state, config: RunnableConfig):
+            if not _stage_timer_attached(config):
+                return fn(state)
+            dispatch_custom_event(STAGE_BODY_START_EVENT, {}, config=config)
+            try:
+                return fn(state)
+            finally:
+                dispatch_custom_event(STAGE_BODY_END_EVENT, {}, config=config)
+
+    node.__name__ = getattr(fn, "__name__", "node")
+    return node
+
+
+class StageTimer(BaseCallbackHandler):
+    """
+    LangGraph 节点耗时统计
+    通过 callback 的 langgraph_node 元数据识别节点级运行，每次运行单独记录（并行 Send 的同名节点不累加）；
+    配合 timed_node 将每次运行拆分为排队 (wait_ms) 与执行 (service_ms) 两部分。
+    """
+
+    # 回调只做计时，必须在调用方内联执行：否则异步图中同步 handler 会被丢进线程池，
+    # 线程池饱和时时间戳本身就会被排队延迟
+    run_inline = True
+
+    def __init__(self):
+        self.runs: List[Dict[str, Any]] = []
+        self._starts: Dict[UUID, tuple] = {}
+        # run_id -> [函数体开始, 函数体结束]
+        self._bodies: Dict[UUID, list] = {}
+        self._lock = threading.Lock()
+
+    def on_chain_start(self, serialized: Optional[Dict[str, Any]], inputs: Any, *, run_id: UUID,
+                       metadata: Optional[Dict[str, Any]] = None, **kwargs: Any) -> None:
+        node = (metadata or {}).get("langgraph_node")
+        # 只统计节点本身的运行，忽略节点内部的子链（如 prompt | llm）
+        if node and kwargs.get("name") == node:
+            with self._lock:
+                self._starts[run_id] = (node, time.perf_counter())
+
+    def on_custom_event(self, name: str, data: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        if name == STAGE_BODY_START_EVENT:
+            with self._lock:
+                self._bodies[run_id] = [time.perf_counter(), None]
+        elif name == STAGE_BODY_END_EVENT:
+            with self._lock:
+                if run_id in self._bodies:
+                    self._bodies[run_id][1] = time.perf_counter()
+
+    def _finish(self, run_id: UUID):
+        end = time.perf_counter()
+        with self._lock:
+            started = self._starts.pop(run_id, None)
+            if started:
+                node, start = started
+                # 未经 timed_node 包装的节点无法区分排队，全部计为执行时间
+                body_start, body_end = self._bodies.pop(run_id, None) or (start, end)
+                total_ms = (end - start) * 1000
+                service_ms = ((body_end or end) - body_start) * 1000
+                self.runs.append({
+                    "node": node,
+                    "total_ms": total_ms,
+                    "wait_ms": total_ms - service_ms,
+                    "service_ms": service_ms,
+                })
+
+    def on_chain_end(self, outputs: Any, *, run_id: UUID, **kwargs: Any) -> None:
+        self._finish(run_id)
+
+    def on_chain_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any) -> None:
+        self._finish(run_id)
+
+    def _max_by_node(self, key: str) -> Dict[str, float]:
+        """同一节点的多次运行是并行的，取最大值作为该阶段耗时"""
+        result: Dict[str, float] = {}
+        for run in self.runs:
+            result[run["node"]] = max(result.get(run["node"], 0.0), run[key])
+        return result
+
+    @property
+    def stages(self) -> Dict[str, float]:
+        return self._max_by_node("total_ms")
+
+    @property
+    def waits(self) -> Dict[str, float]:
+        return self._max_by_node("wait_ms")
+
+
+class _JSONLineFormatter(logging.Formatter):
+    """在后台写入线程中把记录序列化为紧凑 JSON 行"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        return json.dumps(record.msg, ensure_ascii=False, separators=(",", ":"))
+
+
+class TrafficRecorder:
+    """
+    线上流量录制器
+    每个请求追加一行紧凑 JSON：到达时间、脱敏输入、识别意图、端到端及各阶段耗时。
+    请求路径只负责入队，序列化与文件写入由 QueueListener 后台线程通过常驻的追加句柄完成。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        log_dir = os.path.dirname(path)
+        if log_dir and not os.path.exists(log_dir):
+            os.makedirs(log_dir)
+
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._handler = logging.FileHandler(path, mode="a", encoding="utf-8")
+        self._handler.setFormatter(_JSONLineFormatter())
+        self._listener = logging.handlers.QueueListener(self._queue, self._handler)
+        self._listener.start()
+        self._closed = False
+        # 进程退出时写完队列中剩余的记录
+        atexit.register(self.close)
+
+    @classmethod
+    def from_settings(cls, settings: Settings) -> Optional["TrafficRecorder"]:
+        if not settings.traffic.enabled:
+            return None
+        return cls(settings.traffic.path)
+
+    def record(self, arrival: float, user_input: str, result: Optional[Dict[str, Any]],
+               latency_ms: float, timer: StageTimer, error: Optional[str] = None):
+        result = result or {}
+        entry = {
+            "ts": round(arrival, 3),
+            "input": anonymize(user_input),
+            "intent": result.get("primary_intent"),
+            "intents": [sub.get("intent") for sub in result.get("sub_intents") or []],
+            "latency_ms": round(latency_ms, 1),
+            "stages": {node: round(ms, 1) for node, ms in timer.stages.items()},
+            "waits": {node: round(ms, 1) for node, ms in timer.waits.items()},
+        }
+        if error:
+            entry["error"] = error
+
+        if not self._closed:
+            self._queue.put_nowait(logging.makeLogRecord({"msg": entry}))
+
+    def close(self):
+        """停止后台写入线程，写完并刷新剩余记录（可重复调用）"""
+        if self._closed:
+            return
+        self._closed = True
+        self._listener.stop()
+        self._handler.close()
+        atexit.unregister(self.close)
+
+
+async def recorded_ainvoke(graph, state: Dict[str, Any], recorder: Optional[TrafficRecorder] = None,
+                           timer: Optional[StageTimer] = None,
+                           config: Optional[RunnableConfig] = None) -> Dict[str, Any]:
+    """
+    执行图并记录请求（recorder 为空时等价于 graph.ainvoke）
+    :param timer: 调用方需要读取各阶段耗时时传入（如回放工具）
+    :param config: 透传给图的运行配置（如回放时用 metadata 标记日志条目），会追加 timer 回调
+    """
+    config = dict(config or {})
+    # 只有需要耗时数据时才挂载计时器，否则节点不会派发计时事件
+    if recorder or timer:
+        timer = timer or StageTimer()
+        config["callbacks"] = [*(config.get("callbacks") or []), timer]
+
+    arrival = time.time()
+    start = time.perf_counter()
+    result, error = None, None
+    try:
+        result = await graph.ainvoke(state, config=config)
+        return result
+    except Exception as e:
+        error = str(e)
+        raise
+    finally:
+        latency_ms = (time.perf_counter() - start) * 1000
+        if recorder:
+            try:
+                recorder.record(arrival, state.get("user_input", ""), result, latency_ms, timer, error)
+            except Exception as e:
+                logger.warning(f"⚠️ Traffic record failed: {e}")
@@ -0,0 +1,283 @@
+"""
+流量回放工具（容量规划）
+
+按录制日志中的原始到达节奏（或其倍数）回放请求到 smart_home_assistant，
+输出各倍速下的吞吐、延迟分位数与排队时间，并给出排队起点与饱和点。
+
+用法:
+    python -m src.agents.traffic.replay --log ./logs/traffic.jsonl --speeds 1,2,4,8 --llm-backend fake --mcp-backend real
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+from typing import Any, Dict, List, Optional
+
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableConfig, RunnableLambda
+
+from src.agents.intent.jarvis import IntentDecomposition, SubIntent, create_intent_recognition_system
+from src.agents.traffic.recorder import StageTimer, recorded_ainvoke
+from src.config.log_config import setup_logging
+from src.config.settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+# 回放请求在运行配置 metadata 中携带的日志条目序号
+REPLAY_INDEX_KEY = "replay_index"
+
+# 判定阈值
+_QUEUEING_WAIT_RATIO = 0.25     # 排队时间 p95 超过基线 p50 延迟的该比例即视为开始排队
+_SATURATION_THROUGHPUT = 0.9    # 实际吞吐低于下发速率的该比例即视为饱和
+_SATURATION_LATENCY_RATIO = 3.0  # p95 延迟超过基线 p95 的该倍数即视为饱和
+_SATURATION_ERROR_RATE = 0.05
+
+
+def load_traffic(path: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """读取录制日志，按到达时间排序"""
+    entries = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                entries.append(json.loads(line))
+
+    entries.sort(key=lambda e: e["ts"])
+    return entries[:limit] if limit else entries
+
+
+class FakeMcpRegistry:
+    """假 MCP 后端：模拟工具获取耗时，不返回任何工具"""
+
+    def __init__(self, latency_ms: float):
+        self.latency_ms = latency_ms
+        self.managers = {"fake": None}
+
+    async def load(self):
+        return None
+
+    async def get_tools(self):
+        await asyncio.sleep(self.latency_ms / 1000)
+        return []
+
+
+def create_fake_decomposer(entries: List[Dict[str, Any]], latency_ms: float):
+    """
+    假 LLM 后端：模拟意图拆分耗时，并返回录制时解析出的意图
+    按日志条目序号（运行配置 metadata 中的 replay_index）取意图，而不是按脱敏后的输入文本，
+    否则相同输入的不同意图、或脱敏后相同的不同输入会互相覆盖，回放的意图分布就会偏离录制时的分布。
+    保持与真实链一致的同步阻塞调用，以便复现线程池上的排队行为
+    """
+    recorded = [e.get("intents") or [e.get("intent") or "general_chat"] for e in entries]
+
+    def _decompose(inputs: Dict[str, Any], config: RunnableConfig) -> Dict[str, Any]:
+        time.sleep(latency_ms / 1000)
+        index = (config.get("metadata") or {}).get(REPLAY_INDEX_KEY)
+        intents = recorded[index] if index is not None and index < len(recorded) else ["general_chat"]
+        return {
+            "raw": AIMessage(content=""),
+            "parsed": IntentDecomposition(sub_intents=[SubIntent(intent=intent) for intent in intents]),
+            "parsing_error": None,
+        }
+
+    return RunnableLambda(_decompose)
+
+
+def build_graph(llm_backend: str, mcp_backend: str, entries: List[Dict[str, Any]],
+                llm_latency_ms: float, mcp_latency_ms: float):
+    """
+    按后端类型构建回放用的图，LLM 与 MCP 可分别选择 fake / real
+    （如真实 MCP + 假 LLM，用于单独评估工具服务的容量）
+    :return: (图, 图所使用的 MCP 注册中心)
+    """
+    from src.agents.intent.jarvis import intent_recognition_node
+    from src.agents.mcp_client import mcp_registry
+    from src.agents.workflows.jarvis_agent import create_smart_home_assistant
+
+    if llm_backend == "real":
+        intent_node = intent_recognition_node
+    else:
+        intent_node = create_intent_recognition_system(create_fake_decomposer(entries, llm_latency_ms))
+
+    registry = mcp_registry if mcp_backend == "real" else FakeMcpRegistry(mcp_latency_ms)
+    return create_smart_home_assistant(intent_node=intent_node, registry=registry), registry
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = min(len(ordered) - 1, max(0, int(round(pct / 100 * (len(ordered) - 1)))))
+    return ordered[k]
+
+
+def _rate(count: int, span: float) -> Optional[float]:
+    """count 个事件在 span 秒内的速率；少于两个事件或同时发生时无意义，返回 None"""
+    if count < 2 or span <= 0:
+        return None
+    return (count - 1) / span
+
+
+def _service_ms(timer: StageTimer) -> float:
+    """
+    关键路径的纯执行耗时：意图识别 + 最慢的并行分支 + 结果汇总
+    只统计节点函数体内的时间（不含线程池 / 事件循环上的排队），并行分支取最大值而非累加
+    """
+    service: Dict[str, float] = {}
+    for run in timer.runs:
+        service[run["node"]] = max(service.get(run["node"], 0.0), run["service_ms"])
+
+    branches = [ms for node, ms in service.items() if node not in ("intent_recognition", "merge_results")]
+    return service.get("intent_recognition", 0.0) + max(branches, default=0.0) + service.get("merge_results", 0.0)
+
+
+async def replay_once(graph, entries: List[Dict[str, Any]], speed: float) -> Dict[str, Any]:
+    """按 speed 倍速回放一轮，返回该倍速下的统计结果"""
+    loop = asyncio.get_running_loop()
+    first_ts = entries[0]["ts"]
+    samples = []
+
+    async def _run(index: int, entry: Dict[str, Any], scheduled: float):
+        timer = StageTimer()
+        state = {
+            "user_input": entry["input"],
+            "primary_intent": "",
+            "extracted_entities": {},
+            "sub_intents": [],
+            "module_data": {},
+            "assistant_response": "",
+            "active_workflow": None,
+            "error": None,
+        }
+        ok = True
+        try:
+            await recorded_ainvoke(graph, state, timer=timer, config={"metadata": {REPLAY_INDEX_KEY: index}})
+        except Exception as e:
+            logger.warning(f"⚠️ Replay request failed: {e}")
+            ok = False
+
+        finished = loop.time()
+        latency_ms = (finished - scheduled) * 1000
+        samples.append({
+            "ok": ok,
+            "finished": finished,
+            "latency_ms": latency_ms,
+            # 端到端耗时中不属于执行的部分即为排队（含线程池等待）
+            "wait_ms": max(0.0, latency_ms - _service_ms(timer)),
+            "stage_waits": timer.waits,
+        })
+
+    start = loop.time()
+    tasks = []
+    for index, entry in enumerate(entries):
+        scheduled = start + (entry["ts"] - first_ts) / speed
+        delay = scheduled - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(_run(index, entry, scheduled)))
+    await asyncio.gather(*tasks)
+
+    latencies = [s["latency_ms"] for s in samples if s["ok"]]
+    waits = [s["wait_ms"] for s in samples if s["ok"]]
+    finishes = sorted(s["finished"] for s in samples if s["ok"])
+
+    return {
+        "speed": speed,
+        "requests": len(samples),
+        "errors": sum(1 for s in samples if not s["ok"]),
+        # 下发与完成速率都按“首尾之间的间隔数 / 首尾时间差”计算，两者口径一致，
+        # 不会因为完成窗口多出最后一个请求的耗时而被误判为吞吐不足
+        "offered_rps": _rate(len(entries), (entries[-1]["ts"] - first_ts) / speed),
+        "achieved_rps": _rate(len(finishes), finishes[-1] - finishes[0] if finishes else 0.0),
+        "p50_ms": _percentile(latencies, 50),
+        "p95_ms": _percentile(latencies, 95),
+        "p99_ms": _percentile(latencies, 99),
+        "wait_p95_ms": _percentile(waits, 95),
+        # 各阶段排队 p95，用于定位排队发生在哪个节点
+        "stage_wait_p95_ms": {
+            node: _percentile([s["stage_waits"][node] for s in samples if node in s["stage_waits"]], 95)
+            for node in sorted({node for s in samples for node in s["stage_waits"]})
+        },
+    }
+
+
+def analyze(levels: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """以最低倍速为基线，找出排队起点与饱和点"""
+    baseline = levels[0]
+    queueing_onset, saturation = None, None
+
+    for level in levels:
+        if queueing_onset is None and level["wait_p95_ms"] > _QUEUEING_WAIT_RATIO * baseline["p50_ms"]:
+            queueing_onset = level["speed"]
+
+        error_rate = level["errors"] / level["requests"] if level["requests"] else 0.0
+        if saturation is None and (
+                (level["offered_rps"] and level["achieved_rps"] is not None
+                 and level["achieved_rps"] < _SATURATION_THROUGHPUT * level["offered_rps"])
+                or level["p95_ms"] > _SATURATION_LATENCY_RATIO * baseline["p95_ms"]
+                or error_rate > _SATURATION_ERROR_RATE
+        ):
+            saturation = level["speed"]
+
+    return {"queueing_onset_speed": queueing_onset, "saturation_speed": saturation}
+
+
+def print_report(levels: List[Dict[str, Any]], summary: Dict[str, Any]):
+    print(f"\n{'speed':>6} {'req':>5} {'err':>4} {'offered/s':>10} {'achieved/s':>11} "
+          f"{'p50ms':>8} {'p95ms':>8} {'p99ms':>8} {'wait95ms':>9}  queue-stage")
+    for level in levels:
+        stage_waits = level["stage_wait_p95_ms"]
+        hot_stage = max(stage_waits, key=stage_waits.get) if stage_waits else "-"
+        print(f"{level['speed']:>6g} {level['requests']:>5} {level['errors']:>4} {level['offered_rps'] or 0:>10.2f} "
+              f"{level['achieved_rps'] or 0:>11.2f} {level['p50_ms']:>8.1f} {level['p95_ms']:>8.1f} "
+              f"{level['p99_ms']:>8.1f} {level['wait_p95_ms']:>9.1f}  {hot_stage}")
+
+    onset, saturation = summary["queueing_onset_speed"], summary["saturation_speed"]
+    print(f"\n⏳ 排队起点: {f'{onset:g}x' if onset else '未出现'}")
+    print(f"🔥 饱和点: {f'{saturation:g}x' if saturation else '未达到'}")
+
+
+async def replay(args: argparse.Namespace) -> Dict[str, Any]:
+    entries = load_traffic(args.log, args.limit)
+    if not entries:
+        raise ValueError(f"No traffic recorded in {args.log}")
+
+    graph, registry = build_graph(args.llm_backend, args.mcp_backend, entries,
+                                  args.llm_latency_ms, args.mcp_latency_ms)
+    # 与线上一致：开始回放前完成 MCP 服务发现
+    await registry.load()
+
+    levels = []
+    for speed in sorted(float(s) for s in args.speeds.split(",")):
+        logger.info(f"▶️ Replaying {len(entries)} requests at {speed:g}x")
+        levels.append(await replay_once(graph, entries, speed))
+
+    summary = analyze(levels)
+    print_report(levels, summary)
+
+    report = {"levels": levels, **summary}
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay recorded traffic against smart_home_assistant")
+    parser.add_argument("--log", required=True, help="录制日志路径 (TRAFFIC__PATH)")
+    parser.add_argument("--speeds", default="1,2,4,8", help="回放倍速列表，逗号分隔")
+    parser.add_argument("--llm-backend", choices=["fake", "real"], default="fake", help="意图识别 LLM 后端")
+    parser.add_argument("--mcp-backend", choices=["fake", "real"], default="fake", help="MCP 工具服务后端")
+    parser.add_argument("--llm-latency-ms", type=float, default=800.0, help="假 LLM 单次调用耗时")
+    parser.add_argument("--mcp-latency-ms", type=float, default=50.0, help="假 MCP 工具获取耗时")
+    parser.add_argument("--limit", type=int, default=None, help="只回放前 N 条请求")
+    parser.add_argument("--output", default=None, help="JSON 报告输出路径")
+    args = parser.parse_args()
+
+    setup_logging(app_env=get_settings().environment)
+    asyncio.run(replay(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,18 @@
 # 定义状态，继承MessagesState以自动管理消息历史
 import datetime
+import inspect
 import logging
+from typing import List
 
 from langchain_openai import ChatOpenAI
 from langgraph.constants import END
+from langgraph.types import Send
 from langgraph.graph import StateGraph
 
 from src.agents.intent.jarvis import intent_recognition_node
-from src.agents.mcp_client import get_mcp_tools, life_mcp_manager
+from src.agents.mcp_client import mcp_registry
 from src.agents.state import JarvisState
+from src.agents.traffic.recorder import TrafficRecorder, recorded_ainvoke, timed_node
 from src.config.settings import get_settings
 
 logger = logging.getLogger(__name__)
@@ -26,43 +30,126 @@ _LLM_TOOL_CALLING = ChatOpenAI(
     temperature=0  # 确定性输出，适合工具调用场景
 )
 
+# 意图 -> 子工作流节点（兼容降级分类与旧版意图标签）
+_INTENT_ROUTING_MAP = {
+    "weather_query": "weather_workflow",
+    "information_query": "weather_workflow",
+    "assistant": "weather_workflow",
+    "device_control": "device_control_workflow",
+    "smart_home": "device_control_workflow",
+    "iot": "device_control_workflow",
+    "schedule_management": "schedule_workflow",
+    "general_chat": "general_chat_workflow",
+}
+
+_BRANCH_WORKFLOWS = [
+    "weather_workflow",
+    "device_control_workflow",
+    "schedule_workflow",
+    "general_chat_workflow",
+    "clarification_workflow",
+]
+
+
 def create_router():
     """创建动态路由系统"""
 
-    def route_based_on_intent(state: JarvisState) -> str:
-        """根据意图决定下一步执行哪个工作流"""
+    def route_based_on_intent(state: JarvisState) -> List[Send]:
+        """将每个子意图分发到对应工作流，多个子意图并行执行"""
+
+        sub_intents = state.get("sub_intents") or [{
+            "intent": state.get("primary_intent", "general_chat"),
+            "entities": state.get("extracted_entities", {}),
+            "requires_clarification": state.get("module_data", {}).get("requires_clarification", False),
+            "clarification_question": state.get("module_data", {}).get("clarification_question"),
+        }]
+
+        sends = []
+        for index, sub in enumerate(sub_intents):
+            if sub.get("requires_clarification"):
+                node = "clarification_workflow"
+            else:
+                node = _INTENT_ROUTING_MAP.get(sub.get("intent"), "general_chat_workflow")
+
+            # 每个分支只看到属于自己的意图与实体
+            branch_state = {
+                **state,
+                "primary_intent": sub.get("intent", "general_chat"),
+                "extracted_entities": sub.get("entities") or {},
+                "module_data": {
+                    "sub_intent_index": index,
+                    "requires_clarification": sub.get("requires_clarification", False),
+                    "clarification_question": sub.get("clarification_question"),
+                },
+            }
+            sends.append(Send(node, branch_state))
+
+        logger.info(f"🔀 Fan out to {[send.node for send in sends]}")
+        return sends
+
+    return route_based_on_intent
+
+
+# 创建路由函数
+dynamic_router = create_router()
 
-        intent = state.get("primary_intent", "general_chat")
-        requires_clarification = state.get("module_data", {}).get("requires_clarification", False)
 
-        if requires_clarification:
-            return "clarification_workflow"
+def as_branch(name: str, workflow_fn):
+    """
+    将子工作流包装为并行分支节点
+    分支不直接写 assistant_response / module_data（并行写入会冲突），
+    而是追加到 workflow_results，由 merge_results 统一汇总。
+    """
 
-        routing_map = {
-            "device_control": "device_control_workflow",
-            "schedule_management": "schedule_workflow",
-            "information_query": "information_workflow",
-            "emergency_alert": "emergency_workflow",
-            "scene_activation": "scene_workflow",
-            "general_chat": "general_chat_workflow"
+    async def branch(state: JarvisState) -> JarvisState:
+        result = workflow_fn(state)
+        if inspect.isawaitable(result):
+            result = await result
+
+        return {
+            "workflow_results": [{
+                "index": state.get("module_data", {}).get("sub_intent_index", 0),
+                "workflow": name,
+                "intent": state.get("primary_intent"),
+                "assistant_response": result.get("assistant_response", ""),
+                "module_data": result.get("module_data", {}),
+            }]
         }
 
-        return routing_map.get(intent, "general_chat_workflow")
+    return branch
 
-    return route_based_on_intent
 
+def create_merge_results():
+    """汇总并行子工作流结果"""
 
-# 创建路由函数
-dynamic_router = create_router()
+    def merge_results(state: JarvisState) -> JarvisState:
+        results = sorted(state.get("workflow_results", []), key=lambda r: r["index"])
+
+        # 同一工作流可能被多个子意图命中，按子意图顺序逐条保留各分支数据，避免同名键互相覆盖
+        module_data = {
+            **state.get("module_data", {}),
+            "sub_results": [
+                {"index": r["index"], "workflow": r["workflow"], "intent": r["intent"], "data": r["module_data"]}
+                for r in results
+            ],
+        }
 
+        return {
+            "assistant_response": "\n".join(r["assistant_response"] for r in results if r["assistant_response"]),
+            "module_data": module_data,
+            "active_workflow": ",".join(r["workflow"] for r in results),
+        }
+
+    return merge_results
 
-def create_jarvis_workflow():
+
+def create_jarvis_workflow(registry=mcp_registry):
     """天气查询工作流（您之前实现的升级版）"""
 
     async def jarvis_workflow(state: JarvisState) -> JarvisState:
-        #【关键】动态获取并转换工具
-        tools = await get_mcp_tools(life_mcp_manager)
-        logger.info(f"🔧 Loaded {len(tools)} tools from MCP Server")
+        #【关键】从注册中心获取已缓存的工具（启动时并行发现，请求路径不再 list_tools）
+        tools = await registry.get_tools()
+        logger.info(f"🔧 Loaded {len(tools)} tools from {len(registry.managers)} MCP Servers")
 
         # 使用之前实现的天气查询逻辑，但集成到新状态结构中
         city_name = state["extracted_entities"].get("city_name") or "东莞"
@@ -106,6 +193,27 @@ def create_device_control_workflow():
     return device_control_workflow
 
 
+def create_schedule_workflow():
+    """日程管理工作流示例"""
+
+    def schedule_workflow(state: JarvisState) -> JarvisState:
+        time_expression = state["extracted_entities"].get("time_expression", "")
+        action = state["extracted_entities"].get("action", "")
+
+        # 模拟日程创建逻辑
+        if time_expression:
+            response = f"⏰ 已为您设置{time_expression}的提醒{('：' + action) if action else ''}。"
+        else:
+            response = "请告诉我需要在什么时间提醒您？"
+
+        return {
+            "module_data": {"schedule": {"time": time_expression, "action": action}},
+            "assistant_response": response
+        }
+
+    return schedule_workflow
+
+
 def create_general_chat_workflow():
     """通用对话工作流"""
 
@@ -130,8 +238,9 @@ def create_clarification_workflow():
     """信息澄清工作流"""
 
     def clarification_workflow(state: JarvisState) -> JarvisState:
-        question = state.get("module_data", {}).get("clarification_question",
-                                                    "请提供更多详细信息以便我更好地帮助您。")
+        # 问题可能显式为 None（降级分类 / LLM 未给出问题），此时回退到默认问题
+        question = (state.get("module_data", {}).get("clarification_question")
+                    or "请提供更多详细信息以便我更好地帮助您。")
 
         return {
             "assistant_response": question,
@@ -141,38 +250,37 @@ def create_clarification_workflow():
     return clarification_workflow
 
 
-def create_smart_home_assistant():
-    """创建完整的家庭助手工作流"""
+def create_smart_home_assistant(intent_node=intent_recognition_node, registry=mcp_registry):
+    """
+    创建完整的家庭助手工作流
+    :param intent_node: 意图识别节点（流量回放时可替换为假 LLM 后端）
+    :param registry: MCP 服务注册中心（流量回放时可替换为假 MCP 后端）
+    """
 
     workflow = StateGraph(JarvisState)
 
-    # 添加节点
-    workflow.add_node("intent_recognition", intent_recognition_node)
-    workflow.add_node("weather_workflow", create_jarvis_workflow())
-    workflow.add_node("device_control_workflow", create_device_control_workflow())
-    workflow.add_node("general_chat_workflow", create_general_chat_workflow())
-    workflow.add_node("clarification_workflow", create_clarification_workflow())
+    # 添加节点（timed_node 仅在挂载了 StageTimer 的录制 / 回放请求中派发计时事件，用于区分节点的排队与执行耗时）
+    workflow.add_node("intent_recognition", timed_node(intent_node))
+    workflow.add_node("weather_workflow", timed_node(as_branch("weather_workflow", create_jarvis_workflow(registry))))
+    workflow.add_node("device_control_workflow",
+                      timed_node(as_branch("device_control_workflow", create_device_control_workflow())))
+    workflow.add_node("schedule_workflow", timed_node(as_branch("schedule_workflow", create_schedule_workflow())))
+    workflow.add_node("general_chat_workflow",
+                      timed_node(as_branch("general_chat_workflow", create_general_chat_workflow())))
+    workflow.add_node("clarification_workflow",
+                      timed_node(as_branch("clarification_workflow", create_clarification_workflow())))
+    workflow.add_node("merge_results", timed_node(create_merge_results()))
 
     # 设置入口点
     workflow.set_entry_point("intent_recognition")
 
-    # 添加条件路由
-    workflow.add_conditional_edges(
-        "intent_recognition",
-        dynamic_router,
-        {
-            "weather_workflow": "weather_workflow",
-            "device_control_workflow": "device_control_workflow",
-            "general_chat_workflow": "general_chat_workflow",
-            "clarification_workflow": "clarification_workflow"
-        }
-    )
+    # 添加条件路由（Send 并行分发到各子工作流）
+    workflow.add_conditional_edges("intent_recognition", dynamic_router, _BRANCH_WORKFLOWS)
 
-    # 添加直接边（各工作流执行后结束）
-    workflow.add_edge("weather_workflow", END)
-    workflow.add_edge("device_control_workflow", END)
-    workflow.add_edge("general_chat_workflow", END)
-    workflow.add_edge("clarification_workflow", END)
+    # 各工作流执行后汇总结果，再结束
+    for node in _BRANCH_WORKFLOWS:
+        workflow.add_edge(node, "merge_results")
+    workflow.add_edge("merge_results", END)
 
     return workflow.compile()
 
@@ -184,39 +292,52 @@ smart_home_assistant = create_smart_home_assistant()
 async def assistant():
     """测试家庭助手的多功能能力"""
 
+    # 启动时并行连接全部 MCP 服务
+    await mcp_registry.load()
+
+    # 按配置开启流量录制（用于容量规划回放）
+    recorder = TrafficRecorder.from_settings(get_settings())
+
     test_cases = [
         "东莞今天天气怎么样？",
         "打开客厅的灯",
         "你是谁？",
         "设置晚上8点的提醒",
-        "帮我关空调"
+        "帮我关空调",
+        "关空调，顺便告诉我明天东莞天气"
     ]
 
-    for query in test_cases:
-        print(f"\n🧪 用户查询: '{query}'")
-
-        initial_state = {
-            "user_input": query,
-            "primary_intent": "",
-            "extracted_entities": {},
-            "conversation_history": [],
-            "module_data": {},
-            "assistant_response": "",
-            "active_workflow": None,
-            "error": None,
-            "timestamp": datetime.time
-        }
-
-        try:
-            result = await smart_home_assistant.ainvoke(initial_state)
-            print(f"🤖 助手回复: {result['assistant_response']}")
-            print(f"📊 识别意图: {result['primary_intent']}")
-
-        except Exception as e:
-            print(f"❌ 处理失败: {e}")
-
-
-
-import asyncio
-
-asyncio.run(assistant())
+    try:
+        for query in test_cases:
+            print(f"\n🧪 用户查询: '{query}'")
+
+            initial_state = {
+                "user_input": query,
+                "primary_intent": "",
+                "extracted_entities": {},
+                "sub_intents": [],
+                "conversation_history": [],
+                "module_data": {},
+                "assistant_response": "",
+                "active_workflow": None,
+                "error": None,
+                "timestamp": datetime.time
+            }
+
+            try:
+                result = await recorded_ainvoke(smart_home_assistant, initial_state, recorder)
+                print(f"🤖 助手回复: {result['assistant_response']}")
+                print(f"📊 识别意图: {result['primary_intent']}")
+
+            except Exception as e:
+                print(f"❌ 处理失败: {e}")
+    finally:
+        # 写完并刷新剩余的录制记录
+        if recorder:
+            recorder.close()
+
+
+if __name__ == "__main__":
+    import asyncio
+
+    asyncio.run(assistant())
@@ -1,6 +1,6 @@
 import os
 from functools import lru_cache
-from typing import Optional
+from typing import Dict, Optional
 
 from pydantic import Field
 from pydantic_settings import BaseSettings, SettingsConfigDict
@@ -10,6 +10,8 @@ from src.config.constant import Environment, PROJECT_ROOT
 class MCPSettings(BaseSettings):
     host: str = "http://localhost"
     port: int = 8000
+    # 连接 + list_tools 的超时时间（秒），超时的服务不会拖慢其他服务的工具加载
+    timeout: float = 10.0
 
     def get_sse_url(self) -> str:
         return f"{self.host}:{self.port}/sse"
@@ -21,6 +23,8 @@ class LLMSettings(BaseSettings):
     host: str
     key: str
     model: ModelSettings
+    # 服务端前缀缓存路由键 (OpenAI prompt_cache_key)，为空时仅依赖服务端的自动前缀缓存
+    prompt_cache_key: Optional[str] = None
 
     def get_key(self) -> str:
         return self.key
@@ -30,6 +34,12 @@ class LoggerSettings(BaseSettings):
     dir: str = "./logs/"
 
 
+class TrafficSettings(BaseSettings):
+    # 是否录制线上流量（用于容量规划回放）
+    enabled: bool = False
+    path: str = "./logs/traffic.jsonl"
+
+
 class RedisSettings(BaseSettings):
     host: str = "localhost"
     port: int = 6379
@@ -48,6 +58,9 @@ class Settings(BaseSettings):
 
     logger: LoggerSettings
 
+    # 流量录制配置：TRAFFIC__ENABLED / TRAFFIC__PATH
+    traffic: TrafficSettings = Field(default_factory=TrafficSettings)
+
     # SSE配置
     sse_endpoint: str = "/sse"
     heartbeat_interval: int = 30
@@ -55,7 +68,10 @@ class Settings(BaseSettings):
     # llm相关配置
     llm: LLMSettings
 
-    mcp_life: MCPSettings
+    # 兼容旧配置：单个生活服务 MCP (MCP_LIFE__HOST)
+    mcp_life: Optional[MCPSettings] = None
+    # 多 MCP 服务配置：MCP_SERVERS__<NAME>__HOST / MCP_SERVERS__<NAME>__PORT
+    mcp_servers: Dict[str, MCPSettings] = Field(default_factory=dict)
 
     model_config = SettingsConfigDict(
         # 按优先级加载环境文件
@@ -71,6 +87,13 @@ class Settings(BaseSettings):
         extra="ignore",
     )
 
+    def get_mcp_servers(self) -> Dict[str, MCPSettings]:
+        """汇总全部 MCP 服务配置（mcp_life 作为名为 life 的服务加入）"""
+        servers = dict(self.mcp_servers)
+        if self.mcp_life and "life" not in servers:
+            servers = {"life": self.mcp_life, **servers}
+        return servers
+
 
 # 全局配置实例
 @lru_cache()
@@ -0,0 +1,114 @@
+# test_intent.py
+import logging
+
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableLambda
+
+from src.agents.intent.jarvis import (
+    IntentDecomposition,
+    SubIntent,
+    _extract_token_usage,
+    create_intent_recognition_system,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def _fallback_node():
+    """LLM 调用失败的意图识别节点，直接走关键词降级分类"""
+
+    def _raise(inputs):
+        raise RuntimeError("llm unavailable")
+
+    return create_intent_recognition_system(RunnableLambda(_raise))
+
+
+def test_fallback_splits_multiple_matches_in_utterance_order():
+    result = _fallback_node()({"user_input": "设置明早7点的闹钟，再查下天气"})
+    logger.info(f"Fallback sub intents: {result['sub_intents']}")
+
+    assert [sub["intent"] for sub in result["sub_intents"]] == ["schedule_management", "weather_query"]
+    assert result["primary_intent"] == "schedule_management"
+    assert not any(sub["requires_clarification"] for sub in result["sub_intents"])
+
+
+def test_fallback_keeps_overlapping_keywords_in_one_clause_as_single_intent():
+    # "温度" 与 "调" 分属不同类别，但同一分句只是一个调空调的请求
+    result = _fallback_node()({"user_input": "把空调温度调到26度"})
+
+    assert [sub["intent"] for sub in result["sub_intents"]] == ["smart_home"]
+
+
+def test_fallback_splits_compound_command_by_clause():
+    result = _fallback_node()({"user_input": "关空调，顺便告诉我明天东莞天气"})
+
+    assert [sub["intent"] for sub in result["sub_intents"]] == ["smart_home", "weather_query"]
+
+
+def test_fallback_without_match_requires_clarification():
+    result = _fallback_node()({"user_input": "嗯嗯"})
+
+    assert result["primary_intent"] == "general_chat"
+    assert result["sub_intents"][0]["requires_clarification"] is True
+    assert result["module_data"]["requires_clarification"] is True
+
+
+def test_token_usage_from_langchain_usage_metadata():
+    raw = AIMessage(content="", usage_metadata={
+        "input_tokens": 1200, "output_tokens": 30, "total_tokens": 1230,
+        "input_token_details": {"cache_read": 1024},
+    })
+
+    assert _extract_token_usage(raw) == {"prompt_tokens": 1200, "cached_tokens": 1024}
+
+
+def test_token_usage_from_openai_prompt_tokens_details():
+    raw = AIMessage(content="", response_metadata={
+        "token_usage": {"prompt_tokens": 1200, "completion_tokens": 30, "prompt_tokens_details": {"cached_tokens": 896}}
+    })
+
+    assert _extract_token_usage(raw) == {"prompt_tokens": 1200, "cached_tokens": 896}
+
+
+def test_token_usage_from_deepseek_cache_hit_tokens():
+    raw = AIMessage(content="", response_metadata={
+        "token_usage": {"prompt_tokens": 1200, "prompt_cache_hit_tokens": 1152, "prompt_cache_miss_tokens": 48}
+    })
+
+    assert _extract_token_usage(raw) == {"prompt_tokens": 1200, "cached_tokens": 1152}
+
+
+def test_token_usage_without_usage_reports_zero():
+    assert _extract_token_usage(AIMessage(content="")) == {"prompt_tokens": 0, "cached_tokens": 0}
+    assert _extract_token_usage(None) == {"prompt_tokens": 0, "cached_tokens": 0}
+
+
+def test_structured_output_reports_token_usage():
+    raw = AIMessage(content="", usage_metadata={
+        "input_tokens": 1200, "output_tokens": 30, "total_tokens": 1230,
+        "input_token_details": {"cache_read": 1024},
+    })
+    decomposer = RunnableLambda(lambda inputs: {
+        "raw": raw,
+        "parsed": IntentDecomposition(sub_intents=[SubIntent(intent="device_control")]),
+        "parsing_error": None,
+    })
+
+    result = create_intent_recognition_system(decomposer)({"user_input": "打开客厅的灯"})
+
+    assert result["primary_intent"] == "device_control"
+    assert result["module_data"]["token_usage"] == {"intent": {"prompt_tokens": 1200, "cached_tokens": 1024}}
+
+
+def test_parsing_error_routes_to_fallback():
+    decomposer = RunnableLambda(lambda inputs: {
+        "raw": AIMessage(content="not json"),
+        "parsed": None,
+        "parsing_error": ValueError("invalid json"),
+    })
+
+    result = create_intent_recognition_system(decomposer)({"user_input": "打开客厅的灯"})
+
+    # 降级分类的固定置信度，且没有 token 用量
+    assert result["primary_intent"] == "smart_home"
+    assert result["module_data"] == {"intent_confidence": 0.7, "requires_clarification": False}
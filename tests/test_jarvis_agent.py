@@ -0,0 +1,98 @@
+# test_jarvis_agent.py
+import asyncio
+import logging
+
+from langchain_core.runnables import RunnableLambda
+
+from src.agents.intent.jarvis import create_intent_recognition_system
+from src.agents.workflows.jarvis_agent import create_merge_results, create_smart_home_assistant, dynamic_router
+
+logger = logging.getLogger(__name__)
+
+
+def _failing_decomposer():
+    """模拟 LLM 调用失败，触发降级分类"""
+
+    def _raise(inputs):
+        raise RuntimeError("llm unavailable")
+
+    return RunnableLambda(_raise)
+
+
+def test_clarification_falls_back_to_default_question():
+    graph = create_smart_home_assistant(intent_node=create_intent_recognition_system(_failing_decomposer()))
+
+    result = asyncio.run(graph.ainvoke({"user_input": "嗯嗯", "module_data": {}}))
+    logger.info(f"Clarification response: {result['assistant_response']}")
+
+    assert result["active_workflow"] == "clarification_workflow"
+    assert result["assistant_response"] == "请提供更多详细信息以便我更好地帮助您。"
+
+
+def test_merge_results_keeps_data_of_same_workflow_branches():
+    merge_results = create_merge_results()
+    state = {
+        "module_data": {"intent_confidence": 0.9},
+        "workflow_results": [
+            {"index": 1, "workflow": "device_control_workflow", "intent": "device_control",
+             "assistant_response": "✅ 已关闭空调。", "module_data": {"device_control": {"device": "空调"}}},
+            {"index": 0, "workflow": "device_control_workflow", "intent": "device_control",
+             "assistant_response": "✅ 已打开灯。", "module_data": {"device_control": {"device": "灯"}}},
+        ],
+    }
+
+    result = merge_results(state)
+
+    assert result["assistant_response"] == "✅ 已打开灯。\n✅ 已关闭空调。"
+    assert result["module_data"]["intent_confidence"] == 0.9
+    assert [r["data"]["device_control"]["device"] for r in result["module_data"]["sub_results"]] == ["灯", "空调"]
+
+
+def test_router_fans_out_one_send_per_sub_intent():
+    state = {
+        "user_input": "关空调，顺便告诉我明天东莞天气",
+        "module_data": {"intent_confidence": 0.9},
+        "sub_intents": [
+            {"intent": "device_control", "entities": {"device_name": "空调", "action": "关闭"}},
+            {"intent": "weather_query", "entities": {"city_name": "东莞", "time_expression": "明天"}},
+        ],
+    }
+
+    sends = dynamic_router(state)
+
+    assert [send.node for send in sends] == ["device_control_workflow", "weather_workflow"]
+    # 每个分支只携带自己的实体和序号
+    assert sends[0].arg["extracted_entities"] == {"device_name": "空调", "action": "关闭"}
+    assert sends[1].arg["primary_intent"] == "weather_query"
+    assert [send.arg["module_data"]["sub_intent_index"] for send in sends] == [0, 1]
+
+
+def test_router_routes_clarification_and_legacy_labels():
+    state = {
+        "module_data": {},
+        "sub_intents": [
+            {"intent": "iot", "entities": {}},
+            {"intent": "smart_home", "entities": {}},
+            {"intent": "assistant", "entities": {}},
+            {"intent": "unknown_intent", "entities": {}},
+            {"intent": "weather_query", "entities": {}, "requires_clarification": True,
+             "clarification_question": "请问是哪个城市？"},
+        ],
+    }
+
+    sends = dynamic_router(state)
+
+    assert [send.node for send in sends] == [
+        "device_control_workflow",
+        "device_control_workflow",
+        "weather_workflow",
+        "general_chat_workflow",
+        "clarification_workflow",
+    ]
+    assert sends[4].arg["module_data"]["clarification_question"] == "请问是哪个城市？"
+
+
+def test_router_without_sub_intents_uses_primary_intent():
+    sends = dynamic_router({"primary_intent": "schedule_management", "extracted_entities": {}, "module_data": {}})
+
+    assert [send.node for send in sends] == ["schedule_workflow"]
@@ -0,0 +1,173 @@
+# test_mcp_client.py
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+
+import anyio
+import pytest
+
+from src.agents import mcp_client
+from src.agents.mcp_client import McpClientManager, McpServerRegistry, _to_langchain_tools
+from src.config.settings import MCPSettings, Settings
+
+logger = logging.getLogger(__name__)
+
+
+def _tool_def(name: str):
+    return SimpleNamespace(name=name, description=f"{name} tool", inputSchema={"properties": {"city": {}}})
+
+
+class _FakeSession:
+    """模拟 ClientSession：hang_urls 中的服务在 initialize 阶段一直挂起"""
+    hang_urls = set()
+    tools = {}
+
+    def __init__(self, read, write):
+        self.url = read
+        self.initialized = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def initialize(self):
+        if self.url in self.hang_urls:
+            await asyncio.sleep(60)
+        self.initialized = True
+
+    async def list_tools(self):
+        # 握手未完成的会话已失效（连接被超时中断）
+        if not self.initialized:
+            raise ConnectionError("stale session")
+        return SimpleNamespace(tools=[_tool_def(name) for name in self.tools.get(self.url, [])])
+
+    async def call_tool(self, tool_name, kwargs):
+        return SimpleNamespace(content=[SimpleNamespace(type="text", text=f"{self.url}:{tool_name}:{kwargs['city']}")])
+
+
+@asynccontextmanager
+async def _fake_sse_client(url):
+    # 与真实 sse_client 一样持有 anyio task group，跨任务退出会报错
+    async with anyio.create_task_group() as tg:
+        tg.start_soon(anyio.sleep_forever)
+        yield url, None
+        tg.cancel_scope.cancel()
+
+
+@pytest.fixture
+def fake_mcp(monkeypatch):
+    monkeypatch.setattr(mcp_client, "sse_client", _fake_sse_client)
+    monkeypatch.setattr(mcp_client, "ClientSession", _FakeSession)
+    _FakeSession.hang_urls = set()
+    _FakeSession.tools = {}
+    return _FakeSession
+
+
+def _registry(urls, timeout=0.2):
+    return McpServerRegistry(
+        servers={name: McpClientManager(sse_url=url) for name, url in urls.items()},
+        timeouts={name: timeout for name in urls},
+        retry_interval=0
+    )
+
+
+def test_slow_server_does_not_block_others(fake_mcp):
+    fake_mcp.hang_urls = {"iot"}
+    fake_mcp.tools = {"life": ["get_weather"], "iot": ["switch"]}
+    registry = _registry({"life": "life", "iot": "iot"})
+
+    async def _run():
+        start = time.monotonic()
+        await registry.load()
+        elapsed = time.monotonic() - start
+        tools = await registry.get_tools()
+        await registry.close()
+        return elapsed, tools
+
+    elapsed, tools = asyncio.run(_run())
+
+    assert elapsed < 1
+    assert [tool.name for tool in tools] == ["get_weather"]
+    assert registry.failed == {"iot": "timeout"}
+    assert registry.managers["iot"].session is None
+
+
+def test_failed_server_recovers_on_retry(fake_mcp):
+    fake_mcp.hang_urls = {"life"}
+    fake_mcp.tools = {"life": ["get_weather"], "iot": ["switch"]}
+    registry = _registry({"life": "life", "iot": "iot"})
+
+    async def _run():
+        await registry.load()
+        assert "life" in registry.failed
+
+        fake_mcp.hang_urls = set()
+        # 请求路径不等待重试：先返回已加载的工具，失败的服务在后台重连
+        before = [tool.name for tool in await registry.get_tools()]
+        assert registry._retry_task is not None
+        await registry._retry_task
+
+        tools = await registry.get_tools()
+        weather = next(tool for tool in tools if tool.name == "get_weather")
+        answer = await weather.ainvoke({"city": "东莞"})
+        await registry.close()
+        return before, [tool.name for tool in tools], answer
+
+    before, after, answer = asyncio.run(_run())
+    logger.info(f"Tool answer after retry: {answer}")
+
+    assert before == ["switch"]
+    assert after == ["get_weather", "switch"]
+    assert registry.failed == {}
+    assert registry.routing_index == {"get_weather": "life", "switch": "iot"}
+    assert answer == "life:get_weather:东莞"
+
+
+def test_retry_waits_for_retry_interval(fake_mcp):
+    fake_mcp.hang_urls = {"life"}
+    registry = _registry({"life": "life"})
+    registry.retry_interval = 60
+
+    async def _run():
+        await registry.load()
+        await registry.get_tools()
+        await registry.close()
+
+    asyncio.run(_run())
+
+    assert registry._retry_task is None
+    assert "life" in registry.failed
+
+
+def test_rebuild_index_keeps_first_server_on_duplicate_tool():
+    registry = _registry({"life": "life", "iot": "iot"})
+    registry._server_tools = {
+        "iot": _to_langchain_tools([_tool_def("get_time"), _tool_def("switch")], registry.call_tool),
+        "life": _to_langchain_tools([_tool_def("get_time"), _tool_def("get_weather")], registry.call_tool),
+    }
+
+    registry._rebuild_index()
+
+    assert registry.routing_index == {"get_time": "life", "get_weather": "life", "switch": "iot"}
+
+
+def test_get_mcp_servers_registers_legacy_life_first():
+    settings = Settings(
+        mcp_life=MCPSettings(port=8000),
+        mcp_servers={"iot": MCPSettings(port=8002), "calendar": MCPSettings(port=8003)}
+    )
+
+    servers = settings.get_mcp_servers()
+
+    assert list(servers) == ["life", "iot", "calendar"]
+    assert servers["life"].get_sse_url() == "http://localhost:8000/sse"
+
+
+def test_get_mcp_servers_prefers_explicit_life_server():
+    settings = Settings(mcp_life=MCPSettings(port=8000), mcp_servers={"life": MCPSettings(port=9000)})
+
+    assert settings.get_mcp_servers()["life"].port == 9000
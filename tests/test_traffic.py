@@ -0,0 +1,214 @@
+# test_traffic.py
+import asyncio
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from src.agents.intent.jarvis import create_intent_recognition_system
+from src.agents.mcp_client import mcp_registry
+from src.agents.traffic.recorder import StageTimer, TrafficRecorder, anonymize, recorded_ainvoke
+from src.agents.traffic.replay import (
+    REPLAY_INDEX_KEY,
+    FakeMcpRegistry,
+    _percentile,
+    _rate,
+    analyze,
+    build_graph,
+    create_fake_decomposer,
+    replay_once,
+)
+from src.agents.workflows.jarvis_agent import create_smart_home_assistant
+
+logger = logging.getLogger(__name__)
+
+
+def test_anonymize_masks_contacts_and_long_numbers():
+    text = "提醒我给13812345678打电话，邮箱 test.user@example.com，订单 20241019001，晚上8点"
+
+    assert anonymize(text) == "提醒我给<phone>打电话，邮箱 <email>，订单 <num>，晚上8点"
+    assert anonymize("身份证 44190019900101123X") == "身份证 <id>"
+
+
+def test_percentile():
+    values = [float(v) for v in range(1, 101)]
+
+    assert _percentile([], 95) == 0.0
+    assert _percentile([42.0], 99) == 42.0
+    assert _percentile(values, 50) == 51.0
+    assert _percentile(values, 95) == 95.0
+
+
+def _level(speed, offered, achieved, p50, p95, wait_p95, errors=0):
+    return {"speed": speed, "requests": 100, "errors": errors, "offered_rps": offered, "achieved_rps": achieved,
+            "p50_ms": p50, "p95_ms": p95, "p99_ms": p95, "wait_p95_ms": wait_p95, "stage_wait_p95_ms": {}}
+
+
+def test_analyze_finds_queueing_onset_and_saturation():
+    levels = [
+        _level(1, 10, 10, 400, 600, 5),
+        _level(2, 20, 20, 420, 700, 150),
+        _level(4, 40, 30, 2000, 4000, 1800),
+    ]
+
+    assert analyze(levels) == {"queueing_onset_speed": 2, "saturation_speed": 4}
+
+
+def test_analyze_ignores_throughput_without_offered_rate():
+    levels = [_level(1, None, 10, 400, 600, 5), _level(2, None, 10, 400, 600, 5, errors=1)]
+
+    assert analyze(levels) == {"queueing_onset_speed": None, "saturation_speed": None}
+
+
+def test_rate_counts_intervals_between_first_and_last_event():
+    assert _rate(10, 4.5) == 2.0
+    assert _rate(1, 0.0) is None
+    assert _rate(5, 0.0) is None
+
+
+def test_replay_flat_latency_trace_is_not_saturated():
+    # LLM 耗时远大于调度抖动，排队阈值（基线 p50 的 25%）不会被线程池抖动误触发
+    entries = [{"ts": 1000 + 0.1 * i, "input": "打开客厅的灯", "intents": ["device_control"]} for i in range(10)]
+    graph = create_smart_home_assistant(
+        intent_node=create_intent_recognition_system(create_fake_decomposer(entries, latency_ms=300)),
+        registry=FakeMcpRegistry(latency_ms=0)
+    )
+
+    level = asyncio.run(replay_once(graph, entries, speed=1))
+    logger.info(f"Flat trace level: {level}")
+
+    assert level["offered_rps"] == pytest.approx(10, rel=0.01)
+    assert level["achieved_rps"] == pytest.approx(level["offered_rps"], rel=0.1)
+    assert analyze([level]) == {"queueing_onset_speed": None, "saturation_speed": None}
+
+
+def test_fake_decomposer_keeps_recorded_intent_per_entry():
+    # 相同输入 / 脱敏后相同的输入在录制时解析出了不同意图，回放时按条目序号各自还原
+    entries = [
+        {"input": "给<phone>打电话", "intents": ["general_chat"]},
+        {"input": "给<phone>打电话", "intents": ["schedule_management"]},
+        {"input": "给<phone>打电话", "intents": ["device_control", "weather_query"]},
+    ]
+    decomposer = create_fake_decomposer(entries, latency_ms=0)
+
+    parsed = [
+        decomposer.invoke({"user_input": "给<phone>打电话"}, config={"metadata": {REPLAY_INDEX_KEY: index}})["parsed"]
+        for index in range(len(entries))
+    ]
+
+    assert [[sub.intent for sub in p.sub_intents] for p in parsed] == [
+        ["general_chat"], ["schedule_management"], ["device_control", "weather_query"]
+    ]
+
+
+def test_replay_preserves_recorded_intent_mix():
+    entries = [
+        {"ts": 1000 + 0.01 * i, "input": "帮我弄一下", "intents": [intent]}
+        for i, intent in enumerate(["device_control", "weather_query", "schedule_management"])
+    ]
+    graph = create_smart_home_assistant(
+        intent_node=create_intent_recognition_system(create_fake_decomposer(entries, latency_ms=0)),
+        registry=FakeMcpRegistry(latency_ms=0)
+    )
+
+    async def _run():
+        return await asyncio.gather(*(
+            recorded_ainvoke(graph, {"user_input": entry["input"], "module_data": {}},
+                             config={"metadata": {REPLAY_INDEX_KEY: index}})
+            for index, entry in enumerate(entries)
+        ))
+
+    results = asyncio.run(_run())
+
+    assert [r["primary_intent"] for r in results] == ["device_control", "weather_query", "schedule_management"]
+
+
+def test_stage_timer_counts_thread_pool_wait_as_queueing():
+    entries = [{"input": "打开客厅的灯", "intents": ["device_control"]}]
+    graph = create_smart_home_assistant(
+        intent_node=create_intent_recognition_system(create_fake_decomposer(entries, latency_ms=100)),
+        registry=FakeMcpRegistry(latency_ms=0)
+    )
+
+    async def _run():
+        # 单线程线程池：同时到达的 3 个请求在意图识别阶段依次排队
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=1))
+        timers = [StageTimer() for _ in range(3)]
+        await asyncio.gather(*(
+            recorded_ainvoke(graph, {"user_input": "打开客厅的灯", "module_data": {}}, timer=timer)
+            for timer in timers
+        ))
+        return timers
+
+    timers = asyncio.run(_run())
+    intent_runs = [next(r for r in t.runs if r["node"] == "intent_recognition") for t in timers]
+    logger.info(f"Intent runs: {intent_runs}")
+
+    assert all(run["service_ms"] < 180 for run in intent_runs)
+    assert max(run["wait_ms"] for run in intent_runs) > 150
+
+
+def test_stage_timer_does_not_sum_parallel_sends():
+    entries = [{"input": "开灯，关空调", "intents": ["device_control", "device_control"]}]
+    graph = create_smart_home_assistant(
+        intent_node=create_intent_recognition_system(create_fake_decomposer(entries, latency_ms=0)),
+        registry=FakeMcpRegistry(latency_ms=0)
+    )
+    timer = StageTimer()
+
+    asyncio.run(recorded_ainvoke(graph, {"user_input": "开灯，关空调", "module_data": {}}, timer=timer,
+                                 config={"metadata": {REPLAY_INDEX_KEY: 0}}))
+
+    device_runs = [r for r in timer.runs if r["node"] == "device_control_workflow"]
+    assert len(device_runs) == 2
+    assert timer.stages["device_control_workflow"] == max(r["total_ms"] for r in device_runs)
+
+
+def test_recorder_writes_compact_lines_in_background(tmp_path):
+    path = tmp_path / "traffic" / "traffic.jsonl"
+    recorder = TrafficRecorder(str(path))
+    timer = StageTimer()
+    timer.runs = [{"node": "intent_recognition", "total_ms": 120.04, "wait_ms": 20.0, "service_ms": 100.04}]
+
+    result = {"primary_intent": "device_control", "sub_intents": [{"intent": "device_control"}]}
+    recorder.record(1000.0, "给13812345678开灯", result, 130.0, timer)
+    recorder.record(1001.0, "你好", None, 5.0, timer, error="boom")
+    recorder.close()
+    recorder.close()
+
+    lines = path.read_text(encoding="utf-8").splitlines()
+    assert " " not in lines[0]
+    assert json.loads(lines[0]) == {
+        "ts": 1000.0, "input": "给<phone>开灯", "intent": "device_control", "intents": ["device_control"],
+        "latency_ms": 130.0, "stages": {"intent_recognition": 120.0}, "waits": {"intent_recognition": 20.0},
+    }
+    assert json.loads(lines[1])["error"] == "boom"
+
+
+def test_build_graph_selects_llm_and_mcp_backends_independently():
+    entries = [{"ts": 1000, "input": "打开客厅的灯", "intents": ["device_control"]}]
+
+    _, fake_registry = build_graph("real", "fake", entries, llm_latency_ms=0, mcp_latency_ms=5)
+    _, real_registry = build_graph("fake", "real", entries, llm_latency_ms=0, mcp_latency_ms=5)
+
+    assert isinstance(fake_registry, FakeMcpRegistry) and fake_registry.latency_ms == 5
+    assert real_registry is mcp_registry
+
+
+def test_timed_node_skips_events_without_stage_timer():
+    entries = [{"ts": 1000, "input": "打开客厅的灯", "intents": ["device_control"]}]
+    graph = create_smart_home_assistant(
+        intent_node=create_intent_recognition_system(create_fake_decomposer(entries, latency_ms=0)),
+        registry=FakeMcpRegistry(latency_ms=0)
+    )
+
+    async def _custom_events():
+        return [
+            event async for event in graph.astream_events(
+                {"user_input": "打开客厅的灯", "module_data": {}}, version="v2"
+            )
+            if event["event"] == "on_custom_event"
+        ]
+
+    assert asyncio.run(_custom_events()) == []